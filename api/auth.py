@@ -1,11 +1,12 @@
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 import bcrypt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from api.database import get_db
 from api.models import User
+import hmac
 import os
 
 # Secret key to encode the JWT token
@@ -13,6 +14,9 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "b39dc1d5c2e36b8e217d8ef0ddb2164a2f90a9
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # 1 week
 
+# Shared secret for the admin routes; they are disabled when it isn't set
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
 def verify_password(plain_password, hashed_password):
@@ -64,3 +68,9 @@ async def get_optional_current_user(token: str = Depends(OAuth2PasswordBearer(to
         
     user = db.query(User).filter(User.email == email).first()
     return user
+
+# Dependency for admin-only routes: a signed-in user who also presents the admin key
+async def get_current_admin_user(x_admin_key: str | None = Header(default=None), current_user: User = Depends(get_current_user)):
+    if not ADMIN_API_KEY or not x_admin_key or not hmac.compare_digest(x_admin_key.encode("utf-8"), ADMIN_API_KEY.encode("utf-8")):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
@@ -1,15 +1,26 @@
 from fastapi import FastAPI, HTTPException, Depends
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import logging
 import os
 
 from sqlalchemy.orm import Session
 from api.database import engine, Base, get_db
-from api.models import User
-from api.auth import get_password_hash, verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
-from datetime import timedelta
+from api.models import User, Report, SearchHistory, Medication
+from api.auth import get_password_hash, verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, get_optional_current_user, get_current_admin_user
+from datetime import datetime, timedelta, timezone
+
+# Log level comes from the environment; quiet (WARNING) unless overridden
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+_log_level_valid = isinstance(logging.getLevelName(LOG_LEVEL), int)
+logging.basicConfig(level=LOG_LEVEL if _log_level_valid else logging.WARNING)
+logger = logging.getLogger(__name__)
+if not _log_level_valid:
+    logger.warning("Unknown LOG_LEVEL %r, using WARNING", LOG_LEVEL)
 
 # Initialize SQLite database
 # This creates the file 'safewatch.db' and the 'users' table
@@ -17,14 +28,26 @@ Base.metadata.create_all(bind=engine)
 
 from api.utils import (
     fetch_adverse_events, 
+    fetch_adverse_events_many,
     parse_with_llm, 
     parse_message, 
     save_adverse_event,
-    fetch_drug_statistics
+    fetch_drug_statistics,
+    get_http_client,
+    close_http_client,
+    clear_caches,
+    cache_stats,
+    json_dumps
 )
-from api.pdf_generator import generate_report_pdf
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared OpenFDA connection pool up front and close it on shutdown
+    get_http_client()
+    yield
+    await close_http_client()
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS for frontend development
 app.add_middleware(
@@ -57,10 +80,34 @@ class ChatResponse(BaseModel):
     response: str
     data: Optional[List[str]] = None
     stats: Optional[List[dict]] = None
+    stats_drug: Optional[str] = None
     report_saved: bool = False
     missing_info: Optional[List[str]] = None
     warning: Optional[str] = None
 
+# Every field is always present in /api/chat replies, as with ChatResponse
+_CHAT_RESPONSE_DEFAULTS = ChatResponse(response="").model_dump()
+
+def _chat_response(text, **fields):
+    return ChatResponse(response=text, **fields)
+
+def _static_chat_body(text):
+    # Constant replies are serialized once at import
+    return json_dumps({**_CHAT_RESPONSE_DEFAULTS, "response": text})
+
+def _static_chat_response(body):
+    # A fresh Response per request, since FastAPI attaches the request's
+    # background tasks to the returned object
+    return Response(content=body, media_type="application/json")
+
+_EMPTY_INPUT_BODY = _static_chat_body("Please say something!")
+_QUERY_NO_DRUG_BODY = _static_chat_body("I couldn't identify the drug name. Could you specify which drug you are asking about?")
+_REPORT_NO_DRUG_BODY = _static_chat_body("I couldn't identify the drug name. What drug did you take?")
+_REPORT_NO_REACTION_BODY = _static_chat_body("I couldn't identify the reaction. What happened?")
+_UNKNOWN_INTENT_BODY = _static_chat_body(
+    "I didn't quite catch that. Try asking 'What are the side effects of [drug]?' or 'I took [drug] and felt [symptom]'."
+)
+
 class MedicationCreate(BaseModel):
     drug_name: str
     dosage: Optional[str] = None
@@ -101,53 +148,69 @@ async def login(user: UserLogin, db: Session = Depends(get_db)):
     )
     return {"access_token": access_token, "token_type": "bearer", "username": db_user.username, "email": db_user.email}
 
-from api.auth import get_password_hash, verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, get_optional_current_user
-from api.models import User, Report, SearchHistory, Medication
-# ... (keep existing imports, handled below)
-from typing import Optional, List
-
-# ...
+def _query_drugs(drugs, drug_name):
+    """
+    The distinct drugs a query asks about. The LLM's list is only trusted
+    when it really is a list of strings; a single drug is always drug_name.
+    """
+    if not isinstance(drugs, list) or not all(isinstance(d, str) for d in drugs):
+        return [drug_name]
+    drugs = list(dict.fromkeys(d.strip() for d in drugs if d.strip()))
+    return drugs if len(drugs) > 1 else [drug_name]
 
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest, db: Session = Depends(get_db), current_user: Optional[User] = Depends(get_optional_current_user)):
     user_input = request.message.strip()
     
     if not user_input:
-        return ChatResponse(response="Please say something!")
+        return _static_chat_response(_EMPTY_INPUT_BODY)
 
     user_medications = None
     if current_user:
         user_medications = db.query(Medication).filter(Medication.user_id == current_user.id).all()
 
-    # 1. Try LLM first
-    parsed = parse_with_llm(user_input, user_medications)
+    # 1. Try LLM first. The Groq SDK call blocks, so keep it off the event loop
+    parsed = await asyncio.to_thread(parse_with_llm, user_input, user_medications)
     
     warning = parsed.get("response_warning") if parsed else None
     
     # 2. Fallback to Regex if LLM fails or is not configured
     if not parsed:
-        print("Using Regex Fallback")
+        logger.debug("Using Regex Fallback")
         parsed = parse_message(user_input)
     
     if parsed["intent"] == "query":
         drug_name = parsed.get("drug")
         if not drug_name:
-             return ChatResponse(response="I couldn't identify the drug name. Could you specify which drug you are asking about?")
+             return _static_chat_response(_QUERY_NO_DRUG_BODY)
 
-        events = fetch_adverse_events(drug_name)
-        stats = fetch_drug_statistics(drug_name)
+        # Several drugs (e.g. "compare aspirin and ibuprofen") are fetched concurrently,
+        # alongside the statistics lookup
+        drugs = _query_drugs(parsed.get("drugs"), drug_name)
+        if len(drugs) > 1:
+            results, stats = await asyncio.gather(
+                fetch_adverse_events_many(drugs),
+                fetch_drug_statistics(drug_name)
+            )
+            events = [f"[{name}] {event}" for name, found in zip(drugs, results) if found for event in found]
+        else:
+            events, stats = await asyncio.gather(
+                fetch_adverse_events(drug_name),
+                fetch_drug_statistics(drug_name)
+            )
         
         # Save to search history if user is logged in
         if current_user and drug_name:
-            history_record = SearchHistory(user_id=current_user.id, drug=drug_name)
-            db.add(history_record)
+            for name in drugs:
+                db.add(SearchHistory(user_id=current_user.id, drug=name))
             db.commit()
             
+        drug_label = " and ".join(drugs)
         if events:
-            response_text = f"Found {len(events)} recent reports for {drug_name}."
-            return ChatResponse(response=response_text, data=events, stats=stats, warning=warning)
+            response_text = f"Found {len(events)} recent reports for {drug_label}."
+            return _chat_response(response_text, data=events, stats=stats, stats_drug=drug_name if stats else None, warning=warning)
         else:
-            return ChatResponse(response=f"I couldn't find any specific adverse event reports for '{drug_name}' right now.", warning=warning)
+            return _chat_response(f"I couldn't find any specific adverse event reports for '{drug_label}' right now.", warning=warning)
 
     elif parsed["intent"] == "report":
         extracted_data = {
@@ -155,14 +218,14 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db), current_user
             "reaction": parsed.get("reaction"),
             "age": parsed.get("age"),
             "gender": parsed.get("gender"),
-            "timestamp": "now"
+            "timestamp": datetime.now(timezone.utc).isoformat()
         }
         
         missing = []
         if not extracted_data.get("drug"):
-             return ChatResponse(response="I couldn't identify the drug name. What drug did you take?")
+             return _static_chat_response(_REPORT_NO_DRUG_BODY)
         if not extracted_data.get("reaction"):
-             return ChatResponse(response="I couldn't identify the reaction. What happened?")
+             return _static_chat_response(_REPORT_NO_REACTION_BODY)
              
         if not extracted_data["age"]:
             missing.append("age")
@@ -170,8 +233,8 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db), current_user
             missing.append("gender")
             
         if missing:
-            return ChatResponse(
-                response=f"I need a few more details to complete the report. Could you tell me the patient's {' and '.join(missing)}?",
+            return _chat_response(
+                f"I need a few more details to complete the report. Could you tell me the patient's {' and '.join(missing)}?",
                 missing_info=missing
             )
 
@@ -187,8 +250,13 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db), current_user
             db.add(new_report)
             db.commit()
         else:
-            # Fallback to local files if anonymous
-            save_adverse_event(extracted_data)
+            # Fallback to Vercel KV / local files if anonymous, off the event loop
+            saved = await asyncio.to_thread(save_adverse_event, extracted_data)
+            if not saved:
+                return _chat_response(
+                    "I detected a potential adverse event but couldn't save it right now. Please try again in a moment.",
+                    warning=warning
+                )
         
         response_text = (
             f"I detected a potential adverse event and saved it.\n"
@@ -197,11 +265,9 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db), current_user
             f"Age: {extracted_data['age']}\n"
             f"Gender: {extracted_data['gender']}"
         )
-        return ChatResponse(response=response_text, report_saved=True, warning=warning)
+        return _chat_response(response_text, report_saved=True, warning=warning)
 
-    return ChatResponse(
-        response="I didn't quite catch that. Try asking 'What are the side effects of [drug]?' or 'I took [drug] and felt [symptom]'."
-    )
+    return _static_chat_response(_UNKNOWN_INTENT_BODY)
 
 @app.get("/api/user/reports")
 async def get_user_reports(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -239,6 +305,15 @@ async def delete_user_medication(med_id: int, current_user: User = Depends(get_c
     db.commit()
     return {"status": "deleted"}
 
+@app.get("/api/admin/cache")
+async def get_server_cache_stats(current_user: User = Depends(get_current_admin_user)):
+    return cache_stats()
+
+@app.post("/api/admin/cache/clear")
+async def clear_server_caches(current_user: User = Depends(get_current_admin_user)):
+    clear_caches()
+    return {"status": "cleared"}
+
 @app.get("/api/health")
 async def health_check():
     return {"status": "ok"}
@@ -250,7 +325,8 @@ async def export_report_pdf(report_id: int, current_user: User = Depends(get_cur
     if not report:
         raise HTTPException(status_code=404, detail="Report not found")
         
-    # Generate the PDF
+    # Generate the PDF. fpdf is imported here so other routes don't load it on cold start
+    from api.pdf_generator import generate_report_pdf
     pdf_buffer = generate_report_pdf(report)
     
     # Return File Stream Response
@@ -1,186 +1,616 @@
-import requests
+import asyncio
+import httpx
 import json
+import logging
 import re
 import os
-import datetime
-from groq import Groq
+import threading
+from functools import lru_cache
+from cachetools import TTLCache
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib parser
+    orjson = None
+
+try:
+    import re2
+except ImportError:  # google-re2 is optional, the parser falls back to re
+    re2 = None
+
+try:
+    import ahocorasick
+except ImportError:  # without pyahocorasick, drug names come from the regex captures
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
 # --- Configuration ---
 # --- Configuration ---
 # Load .env from the root directory (parent of backend/)
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
 load_dotenv(dotenv_path)
 
-print(f"DEBUG: Loading .env from {os.path.abspath(dotenv_path)}")
+logger.debug("Loading .env from %s", os.path.abspath(dotenv_path))
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-print(f"DEBUG: GROQ_API_KEY found: {bool(GROQ_API_KEY)}")
+logger.debug("GROQ_API_KEY found: %s", bool(GROQ_API_KEY))
+if not GROQ_API_KEY:
+    # Logged once here rather than on every chat request
+    logger.warning("GROQ_API_KEY is missing. Client not initialized.")
 
 OPENFDA_API_URL = "https://api.fda.gov/drug/event.json"
+# Reports requested per adverse-event lookup; only these are parsed
+FDA_EVENTS_LIMIT = 5
 # Use /tmp for Vercel serverless environment (ephemeral storage)
 # In production with persistence, this should be a database.
 # For local dev, we can just use the local file.
-DATA_FILE = "adverse_events.json" 
+DATA_FILE = "adverse_events.jsonl"
+# Reports saved before the switch to JSON Lines, imported once on first save
+LEGACY_DATA_FILE = "adverse_events.json"
 
-if GROQ_API_KEY:
-    try:
-        client = Groq(api_key=GROQ_API_KEY)
-        print("DEBUG: Groq Client initialized successfully.")
-    except Exception as e:
-        print(f"DEBUG: Failed to initialize Groq client: {e}")
-        client = None
+# The Groq SDK is imported on first use so cold starts that never reach the
+# LLM (health checks, auth, exports) don't pay for it
+_groq_client = None
+
+def get_groq_client():
+    global _groq_client
+    if _groq_client is None:
+        if not GROQ_API_KEY:
+            return None
+        try:
+            from groq import Groq
+            _groq_client = Groq(api_key=GROQ_API_KEY)
+            logger.debug("Groq Client initialized successfully.")
+        except Exception as e:
+            logger.error("Failed to initialize Groq client: %s", e)
+    return _groq_client
+
+# --- JSON Helpers ---
+
+if orjson is not None:
+    JSON_DECODE_ERRORS = (orjson.JSONDecodeError, json.JSONDecodeError)
+
+    def json_loads(data):
+        return orjson.loads(data)
+
+    def json_dumps(obj):
+        # orjson emits bytes, which is what the binary file handles expect
+        return orjson.dumps(obj)
 else:
-    print("DEBUG: GROQ_API_KEY is missing. Client not initialized.")
-    client = None
+    JSON_DECODE_ERRORS = (json.JSONDecodeError,)
+
+    def json_loads(data):
+        return json.loads(data)
+
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# --- HTTP Client ---
+
+# Shared connection pool for OpenFDA calls. Keep-alive plus HTTP/2 lets
+# concurrent chat requests reuse one TLS session instead of reconnecting.
+_http_client = None
+
+def get_http_client():
+    global _http_client
+    if _http_client is None:
+        # The transport retries failed connection attempts (not HTTP errors),
+        # which covers a dropped keep-alive socket or a transient DNS/TLS failure.
+        # httpx advertises gzip, plus br when brotli is installed, on its own
+        transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+        _http_client = httpx.AsyncClient(timeout=10, transport=transport)
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+# --- Parsing Patterns ---
+
+REPORT_PATTERNS = [
+    r"took\s+(?P<drug>.*?)\s+and\s+(?:experienced|felt|had)\s+(?P<reaction>.*)",
+    r"after\s+taking\s+(?P<drug>.*?)\s*,\s*i\s+had\s+(?P<reaction>.*)",
+    r"used\s+(?P<drug>.*?)\s+and\s+got\s+(?P<reaction>.*)"
+]
+
+# Vocabulary of known drug names, one per line ('#' starts a comment line)
+DRUG_VOCABULARY_FILE = os.getenv("DRUG_VOCABULARY_FILE", os.path.join(os.path.dirname(__file__), "drug_names.txt"))
+
+def _build_drug_automaton(path):
+    """
+    Loads the drug vocabulary into an Aho-Corasick automaton, or returns None
+    when pyahocorasick or the vocabulary file isn't available.
+    """
+    if ahocorasick is None or not os.path.exists(path):
+        return None
+    automaton = ahocorasick.Automaton()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            name = line.strip().lower()
+            if name and not name.startswith('#'):
+                automaton.add_word(name, name)
+    if len(automaton) == 0:
+        return None
+    automaton.make_automaton()
+    return automaton
+
+_DRUG_AUTOMATON = _build_drug_automaton(DRUG_VOCABULARY_FILE)
+
+# Words that may surround known drug names in a captured span without naming
+# another drug: doses, counts, dosage forms and linking words
+_DRUG_FILLER_WORDS = frozenset({
+    "mg", "mcg", "g", "gram", "grams", "ml", "iu", "unit", "units",
+    "tablet", "tablets", "tab", "tabs", "pill", "pills", "capsule", "capsules",
+    "dose", "doses", "shot", "shots", "injection", "injections", "drops",
+    "a", "an", "one", "two", "three", "some", "few", "several", "half", "x",
+    "the", "my", "his", "her", "their", "this", "that",
+    "and", "or", "plus", "with", "of", "daily", "once", "twice", "per", "day"
+})
+_FILLER_TOKEN_RE = re.compile(r"[^\W\d_]+|\d+")
+
+def _find_known_drugs(span):
+    """
+    Returns the known drug names in span, in order of appearance, from a
+    single linear pass of the automaton. Overlaps keep the longest name.
+    Returns [] unless the rest of span is filler (doses, counts, linking
+    words), so a drug missing from the vocabulary is never dropped.
+    """
+    if _DRUG_AUTOMATON is None:
+        return []
+    hits = []
+    for end, name in _DRUG_AUTOMATON.iter(span):
+        start = end - len(name) + 1
+        # Only whole words count, so "ace" doesn't match inside "face"
+        if (start > 0 and span[start - 1].isalnum()) or (end + 1 < len(span) and span[end + 1].isalnum()):
+            continue
+        hits.append((start, -end, name))
+    names = []
+    rest = []
+    last_end = -1
+    for start, neg_end, name in sorted(hits):
+        if start > last_end:
+            names.append(name)
+            rest.append(span[last_end + 1:start])
+            last_end = -neg_end
+    rest.append(span[last_end + 1:])
+    for token in _FILLER_TOKEN_RE.findall(" ".join(rest)):
+        if not token.isdigit() and token not in _DRUG_FILLER_WORDS:
+            return []
+    return names
+
+# A captured drug span is only split into several drugs when the message is
+# worded as a comparison; "aspirin, 81mg" or "aspirin in children and adults"
+# otherwise stay a single drug
+_COMPARISON_RE = re.compile(r"\b(?:compare|comparing|comparison|vs|versus|between|differences?)\b")
+# Comparison wording captured in front of the drugs, as in "compare aspirin and ibuprofen"
+_COMPARISON_LEAD_RE = re.compile(r"^(?:(?:compare|comparing|comparison|difference|differences|between|of|the)\s+)+")
+_DRUG_LIST_SPLIT_RE = re.compile(r"\s*(?:,|&|\band\b|\bvs\b\.?|\bversus\b)\s*")
+
+# Gender comes from set lookups on the message's words. Age patterns are tried
+# in priority order, so "2 years ago, age 40" reads as 40: "age 25" / "age: 25",
+# then "25 years old" / "25yo", then "(25)"
+_MALE_TOKENS = frozenset({"male", "man", "boy"})
+_FEMALE_TOKENS = frozenset({"female", "woman", "girl"})
+_AGE_PATTERNS = [
+    re.compile(r"\bage\s*(?:is|of|:)?\s*(\d{1,3})\b"),
+    re.compile(r"\b(\d{1,3})\s*-?\s*(?:years?|yrs?|yo)\b"),
+    re.compile(r"\((\d{1,3})\)")
+]
+_TOKEN_RE = re.compile(r"\w+")
+
+# Query Patterns - Expanded for robust natural language understanding
+QUERY_PATTERNS = [
+    # --- Explicit "Show me" / "List" ---
+    r"(?:please\s+)?(?:show|list|give|display|tell)\s+(?:me\s+)?(?:all\s+)?(?:the\s+)?(?:common\s+|potential\s+|possible\s+)?(?:adverse\s+events|side\s+effects|reactions|adverse\s+reactions|negative\s+effects|bad\s+effects|symptoms|issues|problems|complications|hazards|risks|dangers)\s+(?:associated\s+with|related\s+to|caused\s+by|for|of|from)\s+(?P<drug>.*)",
+    
+    # --- "What are" questions ---
+    r"what\s+(?:are|can\s+be)\s+(?:the\s+)?(?:common\s+|potential\s+|possible\s+)?(?:adverse\s+events|side\s+effects|reactions|adverse\s+reactions|negative\s+effects|bad\s+effects|symptoms|issues|problems|complications|hazards|risks|dangers)(?:\s+reported)?\s+(?:associated\s+with|related\s+to|caused\s+by|for|of|from|to|with)\s+(?P<drug>.*)",
+    r"what\s+(?:happens|can\s+happen)\s+(?:if|when)\s+(?:i|you|someone|one)\s+(?:take|takes|use|uses)\s+(?P<drug>.*)",
+    r"what\s+(?:issues|problems)\s+(?:do|does)\s+(?P<drug>.*)\s+(?:cause|have)",
+    
+    # --- Safety / Danger questions ---
+    r"(?:is|are)\s+(?P<drug>.*)\s+(?:safe|dangerous|harmful|bad|risky)(?:\s+to\s+take|to\s+use)?",
+    r"how\s+(?:safe|dangerous|bad|risky)\s+is\s+(?P<drug>.*)",
+    r"(?:safety|danger|risk)\s+(?:profile\s+)?of\s+(?P<drug>.*)",
+    
+    # --- "Does X cause Y?" (Generalized to catch the drug query) ---
+    r"does\s+(?P<drug>.*?)\s+(?:cause|lead\s+to|result\s+in|trigger|produce|create|have)\s+(?:any\s+)?(?:side\s+effects|adverse\s+events|reactions|issues|problems)",
+    r"can\s+(?P<drug>.*?)\s+(?:make\s+you|cause|lead\s+to|result\s+in)\s+(?:feel|have|experience)",
+    
+    # --- Specific "Issues with" / "Report on" ---
+    r"(?:any\s+)?(?:reports|information|data|details|facts|complaints)\s+(?:on|about|regarding|concerning)\s+(?:the\s+)?(?:safety|side\s+effects|adverse\s+events)\s+(?:of|for|with)\s+(?P<drug>.*)",
+    r"(?:problems|issues|concerns|trouble|complications)\s+(?:with|caused\s+by|from|using|taking)\s+(?P<drug>.*)",
+    r"bad\s+(?:reactions|experiences?|things?)\s+(?:to|from|with)\s+(?P<drug>.*)",
+    
+    # --- Short / Conversational ---
+    r"tell\s+me\s+about\s+(?P<drug>.*)",
+    r"(?:side\s+effects|adverse\s+events|reactions)\s+(?:of|for)\s+(?P<drug>.*)",
+    r"(?:side\s+effects|adverse\s+events|reactions)\s+(?P<drug>.*)", # "Side effects Ibuprofen"
+    r"(?P<drug>.*?)\s+(?:side\s+effects|adverse\s+events|reactions|safety)", # "Ibuprofen side effects"
+    
+    # --- Catch-all "Reactions to" ---
+    r"reactions\s+to\s+(?P<drug>.*)"
+]
+
+# Every query pattern requires at least one of these substrings, so a message
+# containing none of them can skip the query patterns without changing results
+_QUERY_KEYWORDS = frozenset({
+    "effects", "events", "reactions", "symptoms", "issues", "problems",
+    "complications", "hazards", "concerns", "trouble", "risk", "danger",
+    "safe", "harmful", "bad", "happen", "can", "tell"
+})
+
+def _suffix_groups(pattern, i):
+    # Gives every branch its own group names (drug0, drug1, ...)
+    return re.sub(r"\(\?P<(\w+)>", rf"(?P<\g<1>{i}>", pattern)
+
+def _compile_pattern(pattern, flags=0):
+    """
+    Compiles with google-re2 when installed, whose linear-time matching keeps
+    the lazy .*? captures safe from catastrophic backtracking on hostile input.
+    re2 takes its own options object rather than re flags, so flagged patterns
+    and anything re2 rejects stay on Python re.
+    """
+    if re2 is not None and not flags:
+        try:
+            return re2.compile(pattern)
+        except re2.error as e:
+            logger.debug("re2 rejected pattern, using re: %s", e)
+    return re.compile(pattern, flags)
+
+class _PatternSet:
+    """
+    An ordered list of patterns where the first one that matches wins.
+
+    The patterns are fused into one alternation whose branches are anchored
+    with a lazy scan, so list order is still the match priority.
+    """
+
+    def __init__(self, patterns, flags=0):
+        suffixed = [_suffix_groups(p, i) for i, p in enumerate(patterns)]
+        self.combined = _compile_pattern(
+            "^(?:" + "|".join(f"(?s:.*?)(?P<p{i}>{p})" for i, p in enumerate(suffixed)) + ")",
+            flags
+        )
+
+    def match(self, text):
+        """Returns (match, index of the pattern that matched) or (None, None)."""
+        match = self.combined.search(text)
+        if not match:
+            return None, None
+        return match, int(match.lastgroup[1:])
+
+# Patterns are written in lowercase and matched against lowercased text,
+# so they are compiled without re.IGNORECASE
+_QUERY_SET = _PatternSet(QUERY_PATTERNS)
+_REPORT_SET = _PatternSet(REPORT_PATTERNS)
+
+# --- Caching ---
+
+# OpenFDA data changes slowly, so successful lookups are reused for a few minutes
+FDA_CACHE_TTL = 600
+FDA_CACHE_MAXSIZE = 1024
+_fda_cache = TTLCache(maxsize=FDA_CACHE_MAXSIZE, ttl=FDA_CACHE_TTL)
+_CACHE_MISS = object()
+
+_kv_redis = None
+
+def _get_kv_redis():
+    """
+    Returns the Vercel KV (Upstash Redis) client, or None when KV isn't configured.
+    """
+    global _kv_redis
+    if _kv_redis is None:
+        KV_REST_API_URL = os.getenv("KV_REST_API_URL")
+        KV_REST_API_TOKEN = os.getenv("KV_REST_API_TOKEN")
+        if not (KV_REST_API_URL and KV_REST_API_TOKEN):
+            return None
+        from upstash_redis import Redis
+        _kv_redis = Redis(url=KV_REST_API_URL, token=KV_REST_API_TOKEN)
+    return _kv_redis
+
+def _kv_cache_key(key):
+    return "fda_cache:" + ":".join(key)
+
+async def _fda_cache_get(key):
+    value = _fda_cache.get(key, _CACHE_MISS)
+    if value is not _CACHE_MISS:
+        logger.debug("FDA cache hit for %s", key)
+        return value
+
+    # Serverless instances don't share memory, so fall back to Vercel KV
+    # which survives cold starts
+    redis = _get_kv_redis()
+    if redis is not None:
+        try:
+            raw = await asyncio.to_thread(redis.get, _kv_cache_key(key))
+            if raw is not None:
+                value = json_loads(raw)
+                _fda_cache[key] = value
+                logger.debug("FDA cache hit for %s (Vercel KV)", key)
+                return value
+        except Exception as e:
+            logger.error("Error reading FDA cache from Vercel KV: %s", e)
+
+    logger.debug("FDA cache miss for %s", key)
+    return _CACHE_MISS
+
+async def _fda_cache_set(key, value):
+    _fda_cache[key] = value
+    redis = _get_kv_redis()
+    if redis is not None:
+        try:
+            payload = json_dumps(value).decode('utf-8')
+            await asyncio.to_thread(redis.set, _kv_cache_key(key), payload, ex=FDA_CACHE_TTL)
+        except Exception as e:
+            logger.error("Error writing FDA cache to Vercel KV: %s", e)
+
+# Validators (ETag / Last-Modified) and extracted results of past OpenFDA
+# responses, so an expired lookup can be revalidated with a conditional GET
+_fda_validators = {}
+
+async def _fda_fetch(params, extract):
+    """
+    GETs OpenFDA and returns extract(body), reusing the stored result on 304.
+    Only the extracted fields are kept, never the raw response body.
+    """
+    key = tuple(sorted(params.items()))
+    stored = _fda_validators.get(key)
+    headers = {}
+    if stored:
+        etag, last_modified, _ = stored
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    response = await get_http_client().get(OPENFDA_API_URL, params=params, headers=headers)
+    if response.status_code == 304 and stored:
+        return stored[2]
+    response.raise_for_status()
+
+    result = extract(json_loads(response.content))
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if etag or last_modified:
+        _fda_validators.pop(key, None)
+        if len(_fda_validators) >= FDA_CACHE_MAXSIZE:
+            _fda_validators.pop(next(iter(_fda_validators)))
+        _fda_validators[key] = (etag, last_modified, result)
+    return result
+
+def clear_caches():
+    _fda_cache.clear()
+    _fda_validators.clear()
+    _parse_message_cached.cache_clear()
+    extract_adverse_event.cache_clear()
+    _parse_with_llm_cached.cache_clear()
+
+def cache_stats():
+    return {
+        "fda": {"currsize": len(_fda_cache), "maxsize": _fda_cache.maxsize},
+        "parse_message": _parse_message_cached.cache_info()._asdict(),
+        "extract_adverse_event": extract_adverse_event.cache_info()._asdict(),
+        "parse_with_llm": _parse_with_llm_cached.cache_info()._asdict()
+    }
 
 # --- Core Functions ---
 
-def fetch_adverse_events(drug_name):
-    print(f"DEBUG: Fetching adverse events for '{drug_name}'...")
+def _extract_events(data):
+    if 'results' not in data:
+        return None
+    events = []
+    for result in data['results'][:FDA_EVENTS_LIMIT]:
+        reactions = [r.get('reactionmeddrapt', 'Unknown') for r in result.get('patient', {}).get('reaction', [])]
+        report_id = result.get('safetyreportid', 'N/A')
+        events.append(f"Report {report_id}: {', '.join(reactions)}")
+    return events
+
+def _extract_top_reactions(data):
+    if 'results' not in data:
+        return None
+    # Return top 10 most common reactions
+    return data['results'][:10]
+
+async def fetch_adverse_events(drug_name):
+    cache_key = ("events", drug_name.lower().strip())
+    cached = await _fda_cache_get(cache_key)
+    if cached is not _CACHE_MISS:
+        return cached
+
+    logger.debug("Fetching adverse events for '%s'...", drug_name)
     try:
         params = {
             'search': f'patient.drug.medicinalproduct:"{drug_name}"',
-            'limit': 5
+            'limit': FDA_EVENTS_LIMIT
         }
-        response = requests.get(OPENFDA_API_URL, params=params, timeout=10) # Added timeout
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if 'results' not in data:
-            return None
-            
-        events = []
-        for result in data['results']:
-            reactions = [r.get('reactionmeddrapt', 'Unknown') for r in result.get('patient', {}).get('reaction', [])]
-            report_id = result.get('safetyreportid', 'N/A')
-            events.append(f"Report {report_id}: {', '.join(reactions)}")
-            
+        events = await _fda_fetch(params, _extract_events)
+        await _fda_cache_set(cache_key, events)
         return events
 
     except Exception as e:
-        print(f"Error fetching data from OpenFDA: {e}")
+        logger.error("Error fetching data from OpenFDA: %s", e)
         return None
 
-def fetch_drug_statistics(drug_name):
-    print(f"DEBUG: Fetching statistics for '{drug_name}'...")
+# Upper bound on OpenFDA requests in flight for one multi-drug lookup,
+# to stay clear of OpenFDA's rate limits
+FDA_MAX_CONCURRENCY = 8
+_fda_semaphore = asyncio.Semaphore(FDA_MAX_CONCURRENCY)
+
+async def fetch_adverse_events_many(drug_names):
+    """
+    Fetches adverse events for several drugs concurrently. Results are
+    returned in the same order as drug_names.
+    """
+    async def fetch_one(drug_name):
+        async with _fda_semaphore:
+            return await fetch_adverse_events(drug_name)
+
+    return await asyncio.gather(*(fetch_one(name) for name in drug_names))
+
+async def fetch_drug_statistics(drug_name):
+    cache_key = ("stats", drug_name.lower().strip())
+    cached = await _fda_cache_get(cache_key)
+    if cached is not _CACHE_MISS:
+        return cached
+
+    logger.debug("Fetching statistics for '%s'...", drug_name)
     try:
         params = {
             'search': f'patient.drug.medicinalproduct:"{drug_name}"',
             'count': 'patient.reaction.reactionmeddrapt.exact'
         }
-        response = requests.get(OPENFDA_API_URL, params=params, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if 'results' not in data:
-            return None
-            
-        # Return top 10 most common reactions
-        return data['results'][:10]
+        stats = await _fda_fetch(params, _extract_top_reactions)
+        await _fda_cache_set(cache_key, stats)
+        return stats
 
     except Exception as e:
-        print(f"Error fetching statistics from OpenFDA: {e}")
+        logger.error("Error fetching statistics from OpenFDA: %s", e)
         return None
 
-def extract_adverse_event(user_input):
-    patterns = [
-        r"took\s+(?P<drug>.*?)\s+and\s+experienced\s+(?P<reaction>.*)",
-        r"took\s+(?P<drug>.*?)\s+and\s+felt\s+(?P<reaction>.*)",
-        r"took\s+(?P<drug>.*?)\s+and\s+had\s+(?P<reaction>.*)",
-        r"after\s+taking\s+(?P<drug>.*?)\s*,\s*I\s+had\s+(?P<reaction>.*)",
-        r"used\s+(?P<drug>.*?)\s+and\s+got\s+(?P<reaction>.*)"
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, user_input, re.IGNORECASE)
-        if match:
-            return {
-                "drug": match.group("drug").strip(),
-                "reaction": match.group("reaction").strip(),
-                "timestamp": datetime.datetime.now().isoformat()
-            }
+@lru_cache(maxsize=2048)
+def extract_adverse_event(text):
+    """
+    Expects already lowercased text, as produced by parse_message.
+    Pure and cached, so callers stamp the time themselves and must not
+    mutate the returned dict.
+    """
+    match, i = _REPORT_SET.match(text)
+    if match:
+        return {
+            "drug": match.group(f"drug{i}").strip(),
+            "reaction": match.group(f"reaction{i}").strip()
+        }
     return None
 
+# Serializes local file writes (and the one-time legacy import) across the
+# worker threads saves run on; Vercel KV pushes don't need it
+_data_file_lock = threading.Lock()
+_legacy_checked = False
+
+def _migrate_legacy_data_file():
+    """
+    Appends the reports from the old JSON array file to DATA_FILE, then
+    renames the old file so they are never imported twice.
+    """
+    global _legacy_checked
+    if _legacy_checked:
+        return
+    _legacy_checked = True
+    if not os.path.exists(LEGACY_DATA_FILE):
+        return
+    try:
+        with open(LEGACY_DATA_FILE, 'rb') as f:
+            existing_data = json_loads(f.read())
+    except JSON_DECODE_ERRORS as e:
+        logger.warning("Could not import %s, leaving it in place: %s", LEGACY_DATA_FILE, e)
+        return
+    if not isinstance(existing_data, list):
+        existing_data = []
+    if existing_data:
+        with open(DATA_FILE, 'ab') as f:
+            f.write(b''.join(json_dumps(event) + b'\n' for event in existing_data))
+    os.replace(LEGACY_DATA_FILE, LEGACY_DATA_FILE + ".migrated")
+    logger.info("Imported %d report(s) from %s into %s", len(existing_data), LEGACY_DATA_FILE, DATA_FILE)
+
 def save_adverse_event(event_data):
+    """
+    Persists one report and returns whether it was saved.
+    """
     try:
-        KV_REST_API_URL = os.getenv("KV_REST_API_URL")
-        KV_REST_API_TOKEN = os.getenv("KV_REST_API_TOKEN")
+        # 1. Try Vercel KV (Upstash Redis) for production persistence.
+        # The push happens before returning, since a serverless instance
+        # can be recycled as soon as the response is sent
+        redis = _get_kv_redis()
+        if redis is not None:
+            redis.lpush("adverse_events", json_dumps(event_data).decode('utf-8'))
+            logger.info("Successfully saved report to Vercel KV Database")
+            return True
 
-        # 1. Try Vercel KV (Upstash Redis) for production persistence
-        if KV_REST_API_URL and KV_REST_API_TOKEN:
-            from upstash_redis import Redis
-            redis = Redis(url=KV_REST_API_URL, token=KV_REST_API_TOKEN)
-            
-            # Save the event to a Redis list
-            redis.lpush("adverse_events", json.dumps(event_data))
-            print("Successfully saved report to Vercel KV Database")
-            return
-
-        # 2. Fallback to local JSON file for local development
-        if os.path.exists(DATA_FILE):
-             with open(DATA_FILE, 'r') as f:
-                try:
-                    existing_data = json.load(f)
-                except json.JSONDecodeError:
-                    existing_data = [] 
-        else:
-            existing_data = []
-            
-        existing_data.append(event_data)
-        
-        with open(DATA_FILE, 'w') as f:
-            json.dump(existing_data, f, indent=4)
+        # 2. Fallback to local JSON Lines file for local development.
+        # Appending one line keeps each save O(1) regardless of history size.
+        with _data_file_lock:
+            _migrate_legacy_data_file()
+            with open(DATA_FILE, 'ab') as f:
+                f.write(json_dumps(event_data) + b'\n')
             
-        print(f"Successfully saved report to {DATA_FILE}")
+        logger.info("Successfully saved report to %s", DATA_FILE)
+        return True
         
     except Exception as e:
-        print(f"Error saving data: {e}")
+        logger.error("Error saving data: %s", e)
+        return False
+
+# Static instructions are sent as an identical system message prefix on every
+# call, so the provider can serve them from its prompt cache
+LLM_SYSTEM_PROMPT = """Analyze the following user text related to drug safety/adverse events.
+Extract the following fields and output a JSON object containing exactly these fields (with no other text):
+- intent: "query" (asking for info), "report" (reporting a personal experience), or "unknown"
+- drug: The correctly spelled, official generic name of the drug mentioned (or null). If the user provides a brand name (e.g., Tylenol, Advil, Lipitor) or mispells the name, you MUST convert it to the correctly spelled generic name (e.g., Acetaminophen, Ibuprofen, Atorvastatin).
+- drugs: A list of the generic names of every drug mentioned, following the same rules as drug (e.g., ["Aspirin", "Ibuprofen"] when comparing two drugs), or [] if none
+- reaction: The adverse event/reaction experienced (for reports) or asked about (optional for queries) (or null)
+- age: Patient age if mentioned (e.g., "25"), else null
+- gender: Patient gender if mentioned (e.g., "Male", "Female"), else null
+- response_warning: If "Current Medications" are listed and relevant to their query or report, provide a brief, polite warning about potential interactions or connections based on this knowledge. However, always explicitly state that they should consult a doctor and that you are an AI, not a medical professional. If no medications are listed or they are not relevant, return null."""
+
+class LLMParseError(Exception):
+    """Raised when every attempt to parse a message with the LLM failed."""
 
 def parse_with_llm(user_input, user_medications=None):
     """
     Uses Groq API to extract structured data from user input.
+    Identical messages (ignoring case and whitespace) from users on the same
+    medications are answered from an LRU cache instead of a new LLM call.
     """
-    import time # needed for retries
-    import traceback
-    print(f"DEBUG: Entering parse_with_llm. Client is: {client}")
+    client = get_groq_client()
+    logger.debug("Entering parse_with_llm. Client is: %s", client)
     if not client:
-        print(f"DEBUG: Client is None, returning None.")
+        logger.debug("Client is None, returning None.")
         return None
-        
-    med_context_instruction = ""
-    if user_medications:
-        med_list = [f"{med.drug_name} ({med.dosage or 'unknown dose'})" for med in user_medications]
-        med_context_instruction = f"""
-    - response_warning: The user is currently taking the following medications: {', '.join(med_list)}. If relevant to their query or report, provide a brief, polite warning about potential interactions or connections based on this knowledge. However, always explicitly state that they should consult a doctor and that you are an AI, not a medical professional. If not relevant, return null."""
-    else:
-        med_context_instruction = "\n    - response_warning: null"
-
-    prompt = f"""
-    Analyze the following user text related to drug safety/adverse events.
-    Extract the following fields and output a JSON object containing exactly these fields (with no other text):
-    - intent: "query" (asking for info), "report" (reporting a personal experience), or "unknown"
-    - drug: The correctly spelled, official generic name of the drug mentioned (or null). If the user provides a brand name (e.g., Tylenol, Advil, Lipitor) or mispells the name, you MUST convert it to the correctly spelled generic name (e.g., Acetaminophen, Ibuprofen, Atorvastatin).
-    - reaction: The adverse event/reaction experienced (for reports) or asked about (optional for queries) (or null)
-    - age: Patient age if mentioned (e.g., "25"), else null
-    - gender: Patient gender if mentioned (e.g., "Male", "Female"), else null{med_context_instruction}
-
-    User Text: "{user_input}"
-    """
+
+    normalized = " ".join(user_input.lower().split())
+    medications = tuple((med.drug_name, med.dosage) for med in user_medications or ())
+    try:
+        # Cached results are shared, so hand each caller its own copy
+        return dict(_parse_with_llm_cached(normalized, medications))
+    except LLMParseError:
+        return None
+
+@lru_cache(maxsize=2048)
+def _parse_with_llm_cached(user_input, medications):
+    # Failures raise instead of returning None so they are never cached
+    import time # needed for retries
+    client = get_groq_client()
+
+    # Only the per-request parts go in the user message, after the static system prompt.
+    # json.dumps quotes and escapes the text so stray quotes can't break the prompt
+    user_message = "User Text: " + json.dumps(user_input, ensure_ascii=False)
+    if medications:
+        med_list = [f"{drug_name} ({dosage or 'unknown dose'})" for drug_name, dosage in medications]
+        user_message = f"Current Medications: {', '.join(med_list)}\n\n{user_message}"
     
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            print(f"DEBUG: Sending prompt to Groq... (Attempt {attempt + 1}/{max_retries})")
+            logger.debug("Sending prompt to Groq... (Attempt %d/%d)", attempt + 1, max_retries)
             # Use JSON mode for reliability
             response = client.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
+                messages=[
+                    {"role": "system", "content": LLM_SYSTEM_PROMPT},
+                    {"role": "user", "content": user_message}
+                ],
                 model='llama-3.3-70b-versatile',
                 response_format={"type": "json_object"}
             )
             raw_text = response.choices[0].message.content.strip()
-            print(f"DEBUG: Raw LLM Response: {raw_text}")
+            logger.debug("Raw LLM Response: %s", raw_text)
             # Failsafe against markdown block wrap
             if raw_text.startswith("```"):
                 lines = raw_text.split("\n")
@@ -194,88 +624,77 @@ def parse_with_llm(user_input, user_medications=None):
                 if start != -1 and end != -1:
                     raw_text = raw_text[start:end+1]
 
-            data = json.loads(raw_text)
-            print(f"DEBUG: Parsed Data: {data}")
+            data = json_loads(raw_text)
+            logger.debug("Parsed Data: %s", data)
             return data
             
         except Exception as e:
-            print(f"LLM Parse Error details (Attempt {attempt + 1}/{max_retries}): {type(e).__name__}: {str(e)}")
-            traceback.print_exc()
+            logger.warning("LLM Parse Error details (Attempt %d/%d): %s: %s", attempt + 1, max_retries, type(e).__name__, e, exc_info=True)
             if attempt < max_retries - 1:
                 time.sleep(1) # Wait 1s before retrying (handles rate limits)
             else:
-                return None
+                raise LLMParseError(str(e)) from e
+
+def _extract_demographics(text):
+    """
+    Pulls (age, gender) out of lowercased text.
+    """
+    gender = None
+    tokens = set(_TOKEN_RE.findall(text))
+    if _MALE_TOKENS & tokens:
+        gender = "Male"
+    elif _FEMALE_TOKENS & tokens:
+        gender = "Female"
+
+    for pattern in _AGE_PATTERNS:
+        for m in pattern.finditer(text):
+            if 0 < int(m.group(1)) < 130:
+                return m.group(1), gender
+
+    return None, gender
 
 def parse_message(user_input):
-    text = user_input.strip().lower()
-    
-    # Query Patterns - Expanded for robust natural language understanding
-    query_patterns = [
-        # --- Explicit "Show me" / "List" ---
-        r"(?:please\s+)?(?:show|list|give|display|tell)\s+(?:me\s+)?(?:all\s+)?(?:the\s+)?(?:common\s+|potential\s+|possible\s+)?(?:adverse\s+events|side\s+effects|reactions|adverse\s+reactions|negative\s+effects|bad\s+effects|symptoms|issues|problems|complications|hazards|risks|dangers)\s+(?:associated\s+with|related\s+to|caused\s+by|for|of|from)\s+(?P<drug>.*)",
-        
-        # --- "What are" questions ---
-        r"what\s+(?:are|can\s+be)\s+(?:the\s+)?(?:common\s+|potential\s+|possible\s+)?(?:adverse\s+events|side\s+effects|reactions|adverse\s+reactions|negative\s+effects|bad\s+effects|symptoms|issues|problems|complications|hazards|risks|dangers)(?:\s+reported)?\s+(?:associated\s+with|related\s+to|caused\s+by|for|of|from|to|with)\s+(?P<drug>.*)",
-        r"what\s+(?:happens|can\s+happen)\s+(?:if|when)\s+(?:i|you|someone|one)\s+(?:take|takes|use|uses)\s+(?P<drug>.*)",
-        r"what\s+(?:issues|problems)\s+(?:do|does)\s+(?P<drug>.*)\s+(?:cause|have)",
-        
-        # --- Safety / Danger questions ---
-        r"(?:is|are)\s+(?P<drug>.*)\s+(?:safe|dangerous|harmful|bad|risky)(?:\s+to\s+take|to\s+use)?",
-        r"how\s+(?:safe|dangerous|bad|risky)\s+is\s+(?P<drug>.*)",
-        r"(?:safety|danger|risk)\s+(?:profile\s+)?of\s+(?P<drug>.*)",
-        
-        # --- "Does X cause Y?" (Generalized to catch the drug query) ---
-        r"does\s+(?P<drug>.*?)\s+(?:cause|lead\s+to|result\s+in|trigger|produce|create|have)\s+(?:any\s+)?(?:side\s+effects|adverse\s+events|reactions|issues|problems)",
-        r"can\s+(?P<drug>.*?)\s+(?:make\s+you|cause|lead\s+to|result\s+in)\s+(?:feel|have|experience)",
-        
-        # --- Specific "Issues with" / "Report on" ---
-        r"(?:any\s+)?(?:reports|information|data|details|facts|complaints)\s+(?:on|about|regarding|concerning)\s+(?:the\s+)?(?:safety|side\s+effects|adverse\s+events)\s+(?:of|for|with)\s+(?P<drug>.*)",
-        r"(?:problems|issues|concerns|trouble|complications)\s+(?:with|caused\s+by|from|using|taking)\s+(?P<drug>.*)",
-        r"bad\s+(?:reactions|experiences?|things?)\s+(?:to|from|with)\s+(?P<drug>.*)",
-        
-        # --- Short / Conversational ---
-        r"tell\s+me\s+about\s+(?P<drug>.*)",
-        r"(?:side\s+effects|adverse\s+events|reactions)\s+(?:of|for)\s+(?P<drug>.*)",
-        r"(?:side\s+effects|adverse\s+events|reactions)\s+(?P<drug>.*)", # "Side effects Ibuprofen"
-        r"(?P<drug>.*?)\s+(?:side\s+effects|adverse\s+events|reactions|safety)", # "Ibuprofen side effects"
-        
-        # --- Catch-all "Reactions to" ---
-        r"reactions\s+to\s+(?P<drug>.*)"
-    ]
+    # Cached results are shared, so hand each caller its own copy
+    return dict(_parse_message_cached(user_input))
+
+@lru_cache(maxsize=1024)
+def _parse_message_cached(user_input):
+    # The chat endpoint has already stripped the input. JSON can carry lone
+    # surrogates, which re2 and the automaton can't encode as UTF-8
+    text = user_input.encode("utf-8", "replace").decode("utf-8").lower()
     
-    for pattern in query_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return {
-                "intent": "query",
-                "drug": match.group("drug").strip("? ."),
-                "reaction": None
-            }
+    # Query Patterns
+    match = None
+    if any(keyword in text for keyword in _QUERY_KEYWORDS):
+        match, i = _QUERY_SET.match(text)
+    if match:
+        drug = match.group(f"drug{i}").strip("? .")
+        comparison = _COMPARISON_RE.search(text)
+        if comparison:
+            drug = _COMPARISON_LEAD_RE.sub("", drug)
+        drugs = _find_known_drugs(drug)
+        if not drugs and comparison:
+            # "compare aspirin and ibuprofen" asks about both drugs
+            drugs = [d.strip("? .") for d in _DRUG_LIST_SPLIT_RE.split(drug)]
+            drugs = [d for d in drugs if d]
+        if not drugs and drug:
+            drugs = [drug]
+        return {
+            "intent": "query",
+            "drug": drugs[0] if drugs else drug,
+            "drugs": drugs,
+            "reaction": None
+        }
 
     # Report Patterns
-    extracted_data = extract_adverse_event(user_input)
+    extracted_data = extract_adverse_event(text)
     if extracted_data:
-        age_patterns = [
-            r"age\s*(?:is|:|of)?\s*(\d{1,3})",
-            r"(\d{1,3})\s*(?:years?|yrs?|yo)(?:\s+old)?",
-            r"\((\d{1,3})\)"
-        ]
-        age = None
-        for p in age_patterns:
-            m = re.search(p, text)
-            if m:
-                age = m.group(1)
-                break
-        
-        gender = None
-        if re.search(r"\b(male|man|boy)\b", text):
-            gender = "Male"
-        elif re.search(r"\b(female|woman|girl)\b", text):
-            gender = "Female"
+        age, gender = _extract_demographics(text)
+        known_drugs = _find_known_drugs(extracted_data["drug"])
 
         return {
             "intent": "report",
-            "drug": extracted_data["drug"],
+            "drug": known_drugs[0] if known_drugs else extracted_data["drug"],
             "reaction": extracted_data["reaction"],
             "age": age,
             "gender": gender
@@ -81,6 +81,7 @@ function Chat() {
                 content: response.data.response,
                 data: response.data.data, // Accessing the list if present
                 stats: response.data.stats, // New stats array
+                statsDrug: response.data.stats_drug, // Drug the stats belong to
                 reportSaved: response.data.report_saved,
                 warning: response.data.warning,
                 timestamp: new Date().toISOString()
@@ -205,7 +206,7 @@ function Chat() {
                                                     initial={{ opacity: 0, marginTop: 0 }}
                                                     animate={{ opacity: 1, marginTop: 16 }}
                                                     className="space-y-2 glass-card p-4 mb-2">
-                                                    {msg.data.slice(0, 5).map((item, i) => (
+                                                    {msg.data.map((item, i) => (
                                                         <motion.li
                                                             initial={{ opacity: 0, x: -10 }}
                                                             animate={{ opacity: 1, x: 0 }}
@@ -225,7 +226,7 @@ function Chat() {
                                                     initial={{ opacity: 0, height: 0 }}
                                                     animate={{ opacity: 1, height: 'auto' }}
                                                 >
-                                                    <AdverseEventsChart data={msg.stats} />
+                                                    <AdverseEventsChart data={msg.stats} drug={msg.statsDrug} />
                                                 </motion.div>
                                             )}
 
@@ -10,7 +10,7 @@ import {
     Cell
 } from 'recharts';
 
-export default function AdverseEventsChart({ data }) {
+export default function AdverseEventsChart({ data, drug }) {
     if (!data || data.length === 0) return null;
 
     // Modern vibrant colors for the bars
@@ -18,7 +18,9 @@ export default function AdverseEventsChart({ data }) {
 
     return (
         <div className="w-full mt-4 bg-[#0A0C10] border border-white/5 rounded-2xl p-4 shadow-xl overflow-hidden">
-            <h3 className="text-white text-md font-semibold mb-4 px-2 tracking-wide">Most Common Reported Reactions</h3>
+            <h3 className="text-white text-md font-semibold mb-4 px-2 tracking-wide">
+                Most Common Reported Reactions{drug ? ` for ${drug}` : ''}
+            </h3>
             <div className="h-[250px] w-full text-xs">
                 <ResponsiveContainer width="100%" height="100%">
                     <BarChart
@@ -0,0 +1,125 @@
+import re
+
+import pytest
+
+from api import utils
+from api.utils import parse_message
+
+
+@pytest.fixture(params=[(False, False), (True, False), (False, True), (True, True)],
+                ids=["re", "re2", "re+automaton", "re2+automaton"])
+def backend(request, monkeypatch):
+    """Rebuilds the parser with and without the optional re2 and Aho-Corasick backends."""
+    use_re2, use_automaton = request.param
+    if use_re2 and utils.re2 is None:
+        pytest.skip("google-re2 is not installed")
+    if not use_re2:
+        monkeypatch.setattr(utils, "re2", None)
+    monkeypatch.setattr(utils, "_QUERY_SET", utils._PatternSet(utils.QUERY_PATTERNS))
+    monkeypatch.setattr(utils, "_REPORT_SET", utils._PatternSet(utils.REPORT_PATTERNS))
+    # Guard against re2 silently rejecting the fused pattern
+    assert isinstance(utils._QUERY_SET.combined, re.Pattern) is not use_re2
+
+    automaton = utils._build_drug_automaton(utils.DRUG_VOCABULARY_FILE) if use_automaton else None
+    if use_automaton and automaton is None:
+        pytest.skip("pyahocorasick is not installed")
+    monkeypatch.setattr(utils, "_DRUG_AUTOMATON", automaton)
+
+    utils.clear_caches()
+    yield use_re2, use_automaton
+    utils.clear_caches()
+
+
+@pytest.mark.parametrize("message, drug", [
+    ("What are the side effects of aspirin?", "aspirin"),
+    ("WHAT ARE THE SIDE EFFECTS OF ASPIRIN?", "aspirin"),
+    ("Show me adverse events for ibuprofen", "ibuprofen"),
+    ("What happens if I take metformin", "metformin"),
+    ("Is metformin safe?", "metformin"),
+    ("How dangerous is warfarin", "warfarin"),
+    ("Does lisinopril cause any side effects", "lisinopril"),
+    ("Problems with sertraline", "sertraline"),
+    ("Tell me about atorvastatin", "atorvastatin"),
+    ("Side effects of omeprazole", "omeprazole"),
+    ("Side effects Ibuprofen", "ibuprofen"),
+    ("Ibuprofen side effects", "ibuprofen"),
+])
+def test_query_forms(backend, message, drug):
+    assert parse_message(message) == {"intent": "query", "drug": drug, "drugs": [drug], "reaction": None}
+
+
+@pytest.mark.parametrize("message, drug, reaction", [
+    ("I took aspirin and felt dizzy", "aspirin", "dizzy"),
+    ("I took aspirin and experienced a headache", "aspirin", "a headache"),
+    ("After taking ibuprofen, I had a rash", "ibuprofen", "a rash"),
+    ("I used metformin and got nausea", "metformin", "nausea"),
+])
+def test_report_forms(backend, message, drug, reaction):
+    parsed = parse_message(message)
+    assert parsed["intent"] == "report"
+    assert parsed["drug"] == drug
+    assert parsed["reaction"] == reaction
+
+
+@pytest.mark.parametrize("message, age, gender", [
+    ("I took aspirin and felt dizzy, I am a 45 year old woman", "45", "Female"),
+    ("I took aspirin and felt dizzy, age: 30, male", "30", "Male"),
+    ("I took aspirin and had a rash (52)", "52", None),
+    ("I took aspirin and felt sick, 64-year-old man", "64", "Male"),
+    # "age N" outranks "N years", which outranks "(N)"
+    ("I took aspirin and felt nausea 2 years ago, age 40, female", "40", "Female"),
+    ("I took aspirin and felt sick (2) 30 years old man", "30", "Male"),
+    # Out of range ages fall through to the next candidate
+    ("I took aspirin and felt sick, age is 200 and 30 years", "30", None),
+    ("I took aspirin and felt sick on page 3", None, None),
+    ("I took aspirin and felt dizzy", None, None),
+])
+def test_report_demographics(backend, message, age, gender):
+    parsed = parse_message(message)
+    assert (parsed["age"], parsed["gender"]) == (age, gender)
+
+
+@pytest.mark.parametrize("message, drugs", [
+    ("compare aspirin and ibuprofen side effects", ["aspirin", "ibuprofen"]),
+    ("Compare the side effects of aspirin and ibuprofen", ["aspirin", "ibuprofen"]),
+    ("aspirin vs ibuprofen side effects", ["aspirin", "ibuprofen"]),
+    ("tell me about ozempic vs mounjaro", ["ozempic", "mounjaro"]),
+    # Without comparison wording, or with a drug missing from the vocabulary,
+    # the captured span is kept whole
+    ("side effects of aspirin in children and adults", ["aspirin in children and adults"]),
+    ("side effects of mounjaro and ozempic", ["mounjaro and ozempic"]),
+])
+def test_multi_drug_queries(backend, message, drugs):
+    parsed = parse_message(message)
+    assert parsed["drugs"] == drugs
+    assert parsed["drug"] == drugs[0]
+
+
+def test_dose_is_dropped_only_with_the_automaton(backend):
+    _, use_automaton = backend
+    expected = "aspirin" if use_automaton else "aspirin, 81mg"
+    assert parse_message("side effects of aspirin, 81mg")["drugs"] == [expected]
+
+
+def test_report_keeps_drugs_missing_from_the_vocabulary(backend):
+    assert parse_message("I took mounjaro and aspirin and felt sick")["drug"] == "mounjaro and aspirin"
+
+
+def test_unknown_intent(backend):
+    assert parse_message("hello there") == {"intent": "unknown", "drug": None, "reaction": None}
+
+
+def test_lone_surrogate_does_not_crash(backend):
+    assert parse_message("hello \ud800")["intent"] == "unknown"
+
+
+def test_lone_surrogate_in_query(backend):
+    parsed = parse_message("What are the side effects of aspirin\ud800?")
+    assert parsed["intent"] == "query"
+    assert parsed["drug"].startswith("aspirin")
+
+
+def test_cached_results_are_copies():
+    first = parse_message("What are the side effects of aspirin?")
+    first["drug"] = "changed"
+    assert parse_message("What are the side effects of aspirin?")["drug"] == "aspirin"